@@ -1,24 +1,27 @@
 from __future__ import annotations
 
+import inspect
 import io
-import json
 import os
+import secrets
 import tempfile
 from typing import Any, Callable
 
+import orjson
 import pandas as pd
+from cachetools import TTLCache
 from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import (
     FileResponse,
-    HTMLResponse,
-    JSONResponse,
+    ORJSONResponse,
+    StreamingResponse,
 )
 
 # === importe seu módulo exatamente como ele está ===
 import rastrear_saojoao as _rsj  # tem buscar_item, _consultar, _search_term, _search_ean, processar_dataframe
 
-app = FastAPI(title="Rastreador São João API")
+app = FastAPI(title="Rastreador São João API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,8 +31,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# guardamos o último XLSX gerado aqui
-_LAST_XLSX_PATH: str | None = None
+# XLSX gerados ficam num cache token -> caminho com TTL; cada resposta ganha o
+# seu próprio link de download, então requisições concorrentes não se atropelam
+def _unlink_silencioso(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class _XlsxCache(TTLCache):
+    """TTLCache que apaga o arquivo do disco quando a entrada sai do cache."""
+
+    def popitem(self):
+        token, path = super().popitem()
+        _unlink_silencioso(path)
+        return token, path
+
+    def expire(self, time=None):
+        expirados = super().expire(time)
+        for _, path in expirados:
+            _unlink_silencioso(path)
+        return expirados
+
+
+_XLSX_CACHE: TTLCache = _XlsxCache(maxsize=128, ttl=600)
+_LAST_TOKEN: str | None = None  # compatibilidade com clientes que usam /baixar_resultado
 
 
 # --------------------------
@@ -41,22 +68,21 @@ def _resolver_funcao(
     papel: str,
     heuristica_substrings: list[str] | None = None,
 ) -> Callable[..., Any]:
+    # índice único de callables por nome minúsculo: evita varrer vars(modulo)
+    # uma vez por candidato
+    callables = {n.lower(): o for n, o in vars(modulo).items() if callable(o)}
+
     # 1) tentativas por nome exato (case-insensitive)
     tried = []
     for nome in candidatos:
         tried.append(nome)
-        for attr_name, obj in vars(modulo).items():
-            if not callable(obj):
-                continue
-            if attr_name.lower() == nome.lower():
-                return obj
+        obj = callables.get(nome.lower())
+        if obj is not None:
+            return obj
 
     # 2) heurística por substrings
     if heuristica_substrings:
-        for attr_name, obj in vars(modulo).items():
-            if not callable(obj):
-                continue
-            low = attr_name.lower()
+        for low, obj in callables.items():
             if any(sub in low for sub in heuristica_substrings):
                 return obj
 
@@ -91,47 +117,78 @@ def _normalize_result(obj: Any) -> list[dict]:
     )
 
 
-def _criar_xlsx(resultados: list[dict]) -> str:
-    df = pd.DataFrame(resultados) if resultados else pd.DataFrame([{}])
+def _criar_xlsx(resultados: pd.DataFrame | list[dict]) -> str:
+    if isinstance(resultados, pd.DataFrame):
+        df = resultados.copy()  # cópia rasa: a coluna Preco é reescrita abaixo
+    else:
+        df = pd.DataFrame(resultados) if resultados else pd.DataFrame([{}])
 
     if {"Link", "Preco"}.issubset(df.columns):
-        def _mk(row: pd.Series):
-            link = str(row.get("Link", ""))
-            preco = str(row.get("Preco", ""))
-            return f'=HYPERLINK("{link}","{preco}")' if link else preco
-        df["Preco"] = df.apply(_mk, axis=1)
+        # concat vetorizado em vez de df.apply por linha
+        link = df["Link"].fillna("").astype(str)
+        preco = df["Preco"].fillna("").astype(str)
+        mask = link.str.len() > 0
+        df["Preco"] = preco
+        df.loc[mask, "Preco"] = '=HYPERLINK("' + link[mask] + '","' + preco[mask] + '")'
 
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
     tmp_path = tmp.name
     tmp.close()
 
-    with pd.ExcelWriter(tmp_path, engine="openpyxl") as w:
+    # strings_to_urls evita o parse de URL célula a célula na coluna Link.
+    # Atenção: nada de constant_memory aqui — o to_excel escreve as células
+    # coluna a coluna e o modo constant_memory descarta em silêncio qualquer
+    # escrita em linha já despejada, corrompendo todas as linhas menos a última.
+    with pd.ExcelWriter(
+        tmp_path,
+        engine="xlsxwriter",
+        engine_kwargs={"options": {"strings_to_urls": False}},
+    ) as w:
         df.to_excel(w, index=False, sheet_name="Resultado")
+        ws = w.sheets["Resultado"]
+        for idx, col in enumerate(df.columns):
+            ws.set_column(idx, idx, 40 if col in {"NOME", "Link", "Classificacao"} else 20)
 
     return tmp_path
 
 
-def _responder(resultados: list[dict], request: Request):
-    global _LAST_XLSX_PATH
-    _LAST_XLSX_PATH = _criar_xlsx(resultados)
+def _responder(resultados: pd.DataFrame | list[dict], request: Request):
+    # DataFrame (upload) vai direto para o xlsx, sem a ida e volta
+    # to_dict -> DataFrame; a lista de registros só existe para JSON/HTML
+    if isinstance(resultados, pd.DataFrame):
+        fonte_xlsx: pd.DataFrame | list[dict] = resultados
+        resultados = resultados.to_dict(orient="records")
+    else:
+        resultados = _normalize_result(resultados)
+        fonte_xlsx = resultados
+
+    global _LAST_TOKEN
+    token = secrets.token_urlsafe(12)
+    _XLSX_CACHE[token] = _criar_xlsx(fonte_xlsx)
+    _LAST_TOKEN = token
 
     wants_html = "text/html" in (request.headers.get("accept") or "").lower()
-    download_url = "/baixar_resultado"
+    download_url = f"/baixar_resultado/{token}"
 
     if wants_html:
-        pretty = json.dumps(resultados, ensure_ascii=False, indent=2)
-        html = f"""
-        <h3>Resultado da busca</h3>
-        <pre>{pretty}</pre>
+        # serializa com orjson (C) e emite em pedaços, sem concatenar o JSON
+        # inteiro numa segunda string gigante de HTML
+        def gen():
+            yield b"<h3>Resultado da busca</h3>\n<pre>"
+            yield orjson.dumps(resultados, option=orjson.OPT_INDENT_2)
+            yield (
+                f"""</pre>
         <form action="{download_url}" method="get">
             <button type="submit" style="padding:10px; background:green; color:white; border:none; border-radius:5px; cursor:pointer;">
                 📄 Baixar Planilha
             </button>
         </form>
         """
-        return HTMLResponse(html)
+            ).encode()
 
-    return JSONResponse({"resultados": resultados, "download_url": download_url})
+        return StreamingResponse(gen(), media_type="text/html")
+
+    return ORJSONResponse({"resultados": resultados, "download_url": download_url})
 
 
 # --------------------------
@@ -146,7 +203,7 @@ _buscar_impl = _resolver_funcao(
 
 _processar_df_impl = _resolver_funcao(
     _rsj,
-    candidatos=["processar_dataframe"],
+    candidatos=["processar_dataframe_async", "processar_dataframe"],
     papel="PROCESSAMENTO DA PLANILHA",
     heuristica_substrings=["process", "planilh", "datafram", "excel"],
 )
@@ -160,16 +217,22 @@ def raiz():
     return {"status": "ok", "app": "Rastreador São João API"}
 
 
+@app.get("/debug/cache")
+def debug_cache():
+    return _rsj.cache_info()
+
+
 @app.post("/buscar")
 async def buscar(request: Request, q: str = Query(..., description="Nome ou EAN")):
     try:
         bruto = _buscar_impl(q)
-        resultados = _normalize_result(bruto)
+        if inspect.isawaitable(bruto):
+            bruto = await bruto
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na busca: {e!s}")
-    return _responder(resultados, request)
+    return _responder(bruto, request)
 
 
 @app.post("/upload")
@@ -179,25 +242,47 @@ async def upload(request: Request, file: UploadFile = File(...)):
 
     data = await file.read()
     try:
-        df_in = pd.read_excel(io.BytesIO(data))
+        # calamine: parser de xlsx em Rust, bem mais rápido e leve que o openpyxl;
+        # dtype=str evita a inferência de tipos (EAN/NOME são usados como texto);
+        # usecols descarta na leitura as colunas que _limpa jogaria fora depois
+        df_in = pd.read_excel(
+            io.BytesIO(data),
+            engine="calamine",
+            usecols=lambda c: str(c).strip().upper() in {"EAN", "NOME"},
+            dtype=str,
+            na_filter=False,
+        )
+        if df_in.shape[1] == 0:
+            # planilha sem cabeçalho EAN/NOME: relê inteira e deixa o fallback
+            # de coluna única do processamento decidir
+            df_in = pd.read_excel(io.BytesIO(data), engine="calamine", dtype=str, na_filter=False)
         bruto = _processar_df_impl(df_in)
-        resultados = _normalize_result(bruto)
+        if inspect.isawaitable(bruto):
+            bruto = await bruto
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar planilha: {e!s}")
 
-    return _responder(resultados, request)
+    return _responder(bruto, request)
 
 
-@app.get("/baixar_resultado")
-def baixar_resultado():
-    global _LAST_XLSX_PATH
-    if not _LAST_XLSX_PATH or not os.path.exists(_LAST_XLSX_PATH):
-        raise HTTPException(status_code=404, detail="Nenhuma planilha gerada ainda.")
+@app.get("/baixar_resultado/{token}")
+def baixar_resultado(token: str):
+    path = _XLSX_CACHE.get(token)
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Planilha não encontrada ou expirada.")
 
     return FileResponse(
-        path=_LAST_XLSX_PATH,
+        path=path,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         filename="resultado.xlsx",
     )
+
+
+@app.get("/baixar_resultado")
+def baixar_ultimo_resultado():
+    # compatibilidade: serve a última planilha gerada neste processo
+    if not _LAST_TOKEN:
+        raise HTTPException(status_code=404, detail="Nenhuma planilha gerada ainda.")
+    return baixar_resultado(_LAST_TOKEN)
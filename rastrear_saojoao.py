@@ -1,13 +1,48 @@
 from __future__ import annotations
-import time, re, urllib.parse
+import asyncio, re, threading, urllib.parse
 from typing import Dict, List, Optional
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
-import requests
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 BASE = "https://www.saojoaofarmacias.com.br"
 HEADERS = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
-PAUSA = 0.5
+MAX_CONCORRENCIA = 8      # requisições simultâneas
+
+# pool compartilhado: conexões TCP/TLS ficam em keep-alive entre as consultas,
+# erros de conexão são retentados no transporte e, com http2, as consultas
+# concorrentes são multiplexadas numa mesma conexão TLS
+CLIENT = httpx.AsyncClient(
+    headers=HEADERS,
+    timeout=25,
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    ),
+)
+
+# throttling adaptativo: nenhuma espera enquanto o servidor responde 2xx;
+# backoff exponencial com jitter só quando ele sinaliza 429/503
+def _eh_throttle(exc: BaseException) -> bool:
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code in (429, 503)
+
+_retry_throttle = retry(
+    retry=retry_if_exception(_eh_throttle),
+    wait=wait_exponential_jitter(initial=0.2, max=5),
+    stop=stop_after_attempt(4),
+    reraise=True,
+)
+
+# cache de consultas: TTL de 1h para não servir preço velho demais
+_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+_CACHE_LOCK = threading.Lock()
+_CACHE_HITS = 0
+_CACHE_MISSES = 0
 
 # ------------ utils ------------
 def _limpa(v) -> str:
@@ -22,70 +57,110 @@ def _preco_br(v) -> str:
     except Exception:
         return "Produto não encontrado"
 
-def _breadcrumb(prod: dict) -> str:
-    tree = prod.get("categoryTree")
-    if isinstance(tree, list) and tree:
-        nomes = [n.get("name") for n in tree if isinstance(n, dict) and n.get("name")]
-        nomes = [n for n in nomes if n.strip().lower() != "início"]
-        if nomes: return " > ".join(nomes)
-    cats = prod.get("categories") or []
-    if cats:
-        caminho = max(cats, key=len).strip("/")
-        partes = [p.replace("-", " ").strip() for p in caminho.split("/") if p.lower() != "início"]
-        if partes: return " > ".join(partes)
-    return "—"
-
-def _price_from_product(prod: dict) -> float:
+def _extract(prod: dict) -> tuple[float, str, str]:
+    # preço, link e classificação numa única passada pelo dict do produto
     try:
-        return float(prod["items"][0]["sellers"][0]["commertialOffer"].get("Price") or 0)
-    except Exception: return 0.0
+        preco = float(prod["items"][0]["sellers"][0]["commertialOffer"].get("Price") or 0)
+    except Exception:
+        preco = 0.0
 
-def _link_from_product(prod: dict) -> str:
     link_text = prod.get("linkText") or ""
     if not link_text:
         name = (prod.get("productName") or "").lower().strip().replace(" ", "-")
         link_text = urllib.parse.quote(name)
-    return f"{BASE}/{link_text}/p"
+    link = f"{BASE}/{link_text}/p"
+
+    classificacao = "—"
+    tree = prod.get("categoryTree")
+    if isinstance(tree, list) and tree:
+        nomes = [n.get("name") for n in tree if isinstance(n, dict) and n.get("name")]
+        nomes = [n for n in nomes if n.strip().lower() != "início"]
+        if nomes: classificacao = " > ".join(nomes)
+    if classificacao == "—":
+        cats = prod.get("categories") or []
+        if cats:
+            caminho = max(cats, key=len).strip("/")
+            partes = [p.replace("-", " ").strip() for p in caminho.split("/") if p.lower() != "início"]
+            if partes: classificacao = " > ".join(partes)
+    return preco, link, classificacao
 
 def _best_match(lista: List[dict], termo_ref: str) -> Optional[dict]:
     if not lista: return None
     ref = (termo_ref or "").lower()
     tokens = [t for t in re.split(r"\s+", ref) if t]
-    def score(p): return (-sum(1 for t in tokens if t in (p.get("productName","") or "").lower()), len(p.get("productName","")))
-    return sorted(lista, key=score)[0]
+    # min() em vez de sorted()[0] (só o mínimo interessa) e lowercase do nome
+    # calculado uma única vez por produto
+    melhor = None
+    melhor_score = None
+    for p in lista:
+        nome_low = (p.get("productName") or "").lower()
+        score = (-sum(1 for t in tokens if t in nome_low), len(nome_low))
+        if melhor_score is None or score < melhor_score:
+            melhor, melhor_score = p, score
+    return melhor
 
 # ------------ consultas ------------
-def _search_ean(ean: str) -> List[dict]:
+@_retry_throttle
+async def _search_ean(ean: str) -> List[dict]:
     url = f"{BASE}/api/catalog_system/pub/products/search/?fq=alternateIds_Ean:{urllib.parse.quote(ean)}"
-    return requests.get(url, headers=HEADERS, timeout=25).json()
+    r = await CLIENT.get(url)
+    r.raise_for_status()
+    return orjson.loads(r.content)
 
-def _search_term(term: str, _from=0, _to=19) -> List[dict]:
+@_retry_throttle
+async def _search_term(term: str, _from=0, _to=19) -> List[dict]:
     url = f"{BASE}/api/catalog_system/pub/products/search/?ft={urllib.parse.quote(term)}&_from={_from}&_to={_to}"
-    return requests.get(url, headers=HEADERS, timeout=25).json()
+    r = await CLIENT.get(url)
+    r.raise_for_status()
+    return orjson.loads(r.content)
+
+_RE_UNITS = re.compile(r"\b\d+\s?(mg|g|mcg|µg|ml|kg|l)\b")
+_RE_FORMS = re.compile(r"\b\d+\s?(comprimidos?|cp|caps?|tabletes?)\b")
+_RE_WS = re.compile(r"\s+")
 
 def _term_simplify(term: str) -> str:
     t = term.lower()
-    t = re.sub(r"\b\d+\s?(mg|g|mcg|µg|ml|kg|l)\b", " ", t)
-    t = re.sub(r"\b\d+\s?(comprimidos?|cp|caps?|tabletes?)\b", " ", t)
-    return re.sub(r"\s+", " ", t).strip() or term
+    t = _RE_UNITS.sub(" ", t)
+    t = _RE_FORMS.sub(" ", t)
+    return _RE_WS.sub(" ", t).strip() or term
 
-def _consultar(termo: str, nome_ref: str="") -> Dict[str,str]:
+async def _consultar(termo: str, nome_ref: str="") -> Dict[str,str]:
+    global _CACHE_HITS, _CACHE_MISSES
+    chave = (termo.strip().lower(), (nome_ref or "").strip().lower())
+    with _CACHE_LOCK:
+        dados = _CACHE.get(chave)
+    if dados is not None:
+        _CACHE_HITS += 1
+        return dict(dados)
+    _CACHE_MISSES += 1
+
+    dados = await _consultar_remoto(termo, nome_ref)
+    with _CACHE_LOCK:
+        _CACHE[chave] = dict(dados)
+    return dados
+
+def cache_info() -> Dict[str, int]:
+    with _CACHE_LOCK:
+        return {"hits": _CACHE_HITS, "misses": _CACHE_MISSES,
+                "tamanho": len(_CACHE), "maxsize": int(_CACHE.maxsize), "ttl": int(_CACHE.ttl)}
+
+async def _consultar_remoto(termo: str, nome_ref: str="") -> Dict[str,str]:
     produtos = []
     t = termo.strip()
 
     # tenta termo primeiro
-    try: produtos = _search_term(t)
+    try: produtos = await _search_term(t)
     except: produtos = []
 
     # fallback: EAN
     if not produtos and t.isdigit() and len(t) >= 8:
-        try: produtos = _search_ean(t)
+        try: produtos = await _search_ean(t)
         except: produtos = []
 
     if not produtos:
         t2 = _term_simplify(t)
         if t2 != t:
-            try: produtos = _search_term(t2)
+            try: produtos = await _search_term(t2)
             except: produtos = []
 
     if not produtos: return {"Preco":"Produto não encontrado","Link":"","Classificacao":"—","Observacao":"Sem resultados"}
@@ -93,11 +168,35 @@ def _consultar(termo: str, nome_ref: str="") -> Dict[str,str]:
     prod = _best_match(produtos, nome_ref or t)
     if not prod: return {"Preco":"Produto não encontrado","Link":"","Classificacao":"—","Observacao":"Sem match"}
 
-    return {"Preco": _preco_br(_price_from_product(prod)), "Link": _link_from_product(prod), "Classificacao": _breadcrumb(prod), "Observacao":"—"}
+    preco, link, classificacao = _extract(prod)
+    return {"Preco": _preco_br(preco), "Link": link, "Classificacao": classificacao, "Observacao":"—"}
+
+async def _processar_linha(ean: str, nome: str) -> Dict[str,str]:
+    # 1) tenta pelo EAN se houver
+    dados = {}
+    if ean:
+        try:
+            dados = await _consultar(ean, nome or ean)
+        except Exception as e:
+            dados = {"Preco": "Produto não encontrado", "Link": "", "Classificacao": "—", "Observacao": f"Erro: {e}"}
+
+    # 2) fallback: se falhou com EAN, tenta pelo NOME
+    if (not dados) or (dados.get("Preco") == "Produto não encontrado"):
+        if nome:
+            try:
+                dados = await _consultar(nome, nome)
+            except Exception as e:
+                dados = {"Preco": "Produto não encontrado", "Link": "", "Classificacao": "—", "Observacao": f"Erro: {e}"}
+        else:
+            # se não tinha nome, mantém o resultado anterior (provavelmente "não encontrado")
+            if not dados:
+                dados = {"Preco": "Produto não encontrado", "Link": "", "Classificacao": "—", "Observacao": "Sem resultados"}
+
+    return dados
 
 # ------------ público ------------
-def buscar_item(q: str) -> list[dict]:
-    dados = _consultar(q, q)
+async def buscar_item(q: str) -> list[dict]:
+    dados = await _consultar(q, q)
     return [{
         "EAN": q if q.isdigit() else "",
         "NOME": q,  # garante nome preenchido
@@ -107,7 +206,7 @@ def buscar_item(q: str) -> list[dict]:
         "Observacao": dados.get("Observacao","—"),
     }]
 
-def processar_dataframe(df_in: pd.DataFrame) -> pd.DataFrame:
+async def processar_dataframe_async(df_in: pd.DataFrame) -> pd.DataFrame:
     df = df_in.copy()
     df.columns = [c.upper().strip() for c in df.columns]
 
@@ -118,41 +217,54 @@ def processar_dataframe(df_in: pd.DataFrame) -> pd.DataFrame:
         else:
             raise ValueError("A planilha precisa ter ao menos a coluna NOME ou EAN.")
 
-    saida = []
-    for _, row in df.iterrows():
-        ean = _limpa(row.get("EAN", ""))
-        nome = _limpa(row.get("NOME", ""))
-        termo = ean or nome
-
-        if not termo:
-            saida.append({
-                "EAN": ean, "NOME": nome,
-                "Preco": "Produto não encontrado", "Link": "",
-                "Classificacao": "—", "Observacao": "Linha vazia"
-            })
-            continue
-
-        # 1) tenta pelo EAN se houver
-        dados = {}
-        if ean:
-            try:
-                dados = _consultar(ean, nome or ean)
-            except Exception as e:
-                dados = {"Preco": "Produto não encontrado", "Link": "", "Classificacao": "—", "Observacao": f"Erro: {e}"}
+    # zip de arrays numpy: iteração em tuplas C, sem construir uma Series por linha
+    n = len(df)
+    eans = df.get("EAN", pd.Series([""] * n)).astype(str).map(_limpa).to_numpy()
+    nomes = df.get("NOME", pd.Series([""] * n)).astype(str).map(_limpa).to_numpy()
+    # máscara vetorizada das linhas sem termo: essas nem entram na fase de rede
+    vazias = (eans == "") & (nomes == "")
+
+    sem = asyncio.Semaphore(MAX_CONCORRENCIA)
+
+    async def _bounded(ean: str, nome: str) -> Dict[str,str]:
+        async with sem:
+            return await _processar_linha(ean, nome)
+
+    # consulta uma vez por chave única; linhas duplicadas reusam o resultado
+    unicos = list(dict.fromkeys(zip(eans[~vazias], nomes[~vazias])))
+    valores = await asyncio.gather(*[_bounded(ean, nome) for ean, nome in unicos])
+    resultados = dict(zip(unicos, valores))
+
+    # colunas pré-alocadas em vez de lista de dicts: o DataFrame final é montado
+    # direto dos arrays, sem varrer um dict por linha
+    out_ean = eans.astype(object)
+    out_nome = nomes.astype(object)
+    out_preco = np.empty(n, dtype=object)
+    out_link = np.empty(n, dtype=object)
+    out_class = np.empty(n, dtype=object)
+    out_obs = np.empty(n, dtype=object)
 
-        # 2) fallback: se falhou com EAN, tenta pelo NOME
-        if (not dados) or (dados.get("Preco") == "Produto não encontrado"):
-            if nome:
-                try:
-                    dados = _consultar(nome, nome)
-                except Exception as e:
-                    dados = {"Preco": "Produto não encontrado", "Link": "", "Classificacao": "—", "Observacao": f"Erro: {e}"}
-            else:
-                # se não tinha nome, mantém o resultado anterior (provavelmente "não encontrado")
-                if not dados:
-                    dados = {"Preco": "Produto não encontrado", "Link": "", "Classificacao": "—", "Observacao": "Sem resultados"}
-
-        saida.append({"EAN": ean, "NOME": nome or termo, **dados})
-        time.sleep(PAUSA)
-
-    return pd.DataFrame(saida, columns=["EAN", "NOME", "Preco", "Link", "Classificacao", "Observacao"])
+    # linhas vazias preenchidas em bloco, sem passar pelo loop de rede
+    out_preco[vazias] = "Produto não encontrado"
+    out_link[vazias] = ""
+    out_class[vazias] = "—"
+    out_obs[vazias] = "Linha vazia"
+
+    for i in np.flatnonzero(~vazias):
+        ean, nome = eans[i], nomes[i]
+        dados = resultados[(ean, nome)]
+        out_nome[i] = nome or ean
+        out_preco[i] = dados.get("Preco", "")
+        out_link[i] = dados.get("Link", "")
+        out_class[i] = dados.get("Classificacao", "—")
+        out_obs[i] = dados.get("Observacao", "—")
+
+    return pd.DataFrame(
+        {"EAN": out_ean, "NOME": out_nome, "Preco": out_preco,
+         "Link": out_link, "Classificacao": out_class, "Observacao": out_obs},
+        copy=False,
+    )
+
+def processar_dataframe(df_in: pd.DataFrame) -> pd.DataFrame:
+    # wrapper síncrono para uso fora de um event loop (scripts/CLI)
+    return asyncio.run(processar_dataframe_async(df_in))
@@ -0,0 +1,61 @@
+import os
+
+import openpyxl
+import pandas as pd
+
+import main
+
+
+RESULTADOS = [
+    {"EAN": "7891058014684", "NOME": "Dipirona 500mg", "Preco": "R$ 9,90",
+     "Link": "https://www.saojoaofarmacias.com.br/dipirona-500mg/p",
+     "Classificacao": "Medicamentos > Dor", "Observacao": "—"},
+    {"EAN": "7896422503184", "NOME": "Paracetamol 750mg", "Preco": "R$ 7,50",
+     "Link": "https://www.saojoaofarmacias.com.br/paracetamol-750mg/p",
+     "Classificacao": "Medicamentos > Dor", "Observacao": "—"},
+    {"EAN": "", "NOME": "Omeprazol 20mg", "Preco": "Produto não encontrado",
+     "Link": "", "Classificacao": "—", "Observacao": "Sem resultados"},
+]
+
+
+def test_roundtrip_multilinha():
+    # regressão: com constant_memory o xlsxwriter descartava em silêncio as
+    # escritas do to_excel em linhas já despejadas, e só a última linha voltava
+    # inteira. Todas as linhas e colunas precisam sobreviver à releitura.
+    path = main._criar_xlsx(RESULTADOS)
+    try:
+        ws = openpyxl.load_workbook(path).active
+        assert ws.max_row == len(RESULTADOS) + 1  # cabeçalho + dados
+        cols = [c.value for c in ws[1]]
+        assert cols == ["EAN", "NOME", "Preco", "Link", "Classificacao", "Observacao"]
+        for i, esperado in enumerate(RESULTADOS, start=2):
+            linha = dict(zip(cols, (c.value for c in ws[i])))
+            assert linha["NOME"] == esperado["NOME"], linha
+            assert linha["Link"] == (esperado["Link"] or None), linha
+            assert linha["Classificacao"] == esperado["Classificacao"], linha
+            assert linha["Observacao"] == esperado["Observacao"], linha
+            # com link, Preco vira fórmula HYPERLINK; sem link, fica o texto
+            if esperado["Link"]:
+                assert linha["Preco"] == f'=HYPERLINK("{esperado["Link"]}","{esperado["Preco"]}")', linha
+            else:
+                assert linha["Preco"] == esperado["Preco"], linha
+    finally:
+        os.unlink(path)
+
+
+def test_roundtrip_dataframe():
+    # o caminho do /upload passa um DataFrame direto; mesma garantia
+    path = main._criar_xlsx(pd.DataFrame(RESULTADOS))
+    try:
+        relido = pd.read_excel(path, dtype=str)
+        assert len(relido) == len(RESULTADOS)
+        assert relido["NOME"].tolist() == [r["NOME"] for r in RESULTADOS]
+        assert relido["Observacao"].tolist() == [r["Observacao"] for r in RESULTADOS]
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    test_roundtrip_multilinha()
+    test_roundtrip_dataframe()
+    print("✅ round-trip ok")